@@ -1,11 +1,22 @@
 import os
 import json
 import pathlib
+import re
 import shutil
-import statistics
+import warnings
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson  # 可选：更快的 JSON 序列化
+except ImportError:
+    orjson = None
 
 # =================== 配置 ===================
 API_URL = "https://api.aring.cc/awakening-of-war-soul-ol/api/commerce/list"
@@ -23,11 +34,13 @@ COMMERCE_MAP = {
     4: "明钻商户",
     5: "魔龙教会",
 }
+_CIDS = tuple(sorted(COMMERCE_MAP))  # 历史文件中价格列的顺序
+_EXPECTED_HEADER = ["日期", "时间"] + [COMMERCE_MAP[cid] for cid in _CIDS]
 
 HEADERS = {
     "Host": "api.aring.cc",
     "Origin": "https://aring.cc",
-    "Accept-Encoding": "gzip, deflate, br",
+    "Accept-Encoding": "gzip, deflate",  # 不声明 br：未装 brotli 时 requests 无法解码
     "Connection": "keep-alive",
     "Accept": "application/json, text/plain, */*",
     "User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 16_2_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) CriOS/134.0.6998.33 Mobile/15E148 Safari/604.1",
@@ -36,6 +49,12 @@ HEADERS = {
     "token": os.getenv("ARING_TOKEN", ""),  # 从 Secrets 注入
 }
 
+# 复用连接（keep-alive），一次 TLS 握手；连接类错误自动重试
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4,
+                                      max_retries=Retry(total=2, backoff_factor=0.3)))
+
 # =================== 时间工具 ===================
 def now_cst():
     return datetime.now(CST)
@@ -71,62 +90,123 @@ def ensure_local_history_only():
     else:
         print("ℹ️ 仓库中暂无 price_history.txt，将从空文件开始")
 
-def load_historical_data():
-    """读取历史 price_history.txt，返回 {cid: [prices...]}"""
-    hist = {cid: [] for cid in COMMERCE_MAP.keys()}
-    if not os.path.exists(DATA_FILE):
-        return hist
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        lines = [ln.strip() for ln in f.readlines() if ln.strip()]
-    if not lines:
-        return hist
-
-    header = lines[0].split()
-    expected_header = ["日期", "时间"] + [COMMERCE_MAP[cid] for cid in sorted(COMMERCE_MAP.keys())]
-    if header != expected_header:
-        print("⚠️ 表头不匹配，忽略历史。")
-        return hist
-
-    for line in lines[1:]:
-        parts = line.split()
-        if len(parts) < 2 + len(COMMERCE_MAP):
+def _to_float(token):
+    try:
+        return float(token)
+    except ValueError:
+        return np.nan
+
+def _parse_history_lines(f):
+    """逐行容错解析（loadtxt 遇到坏行时的退路）：列数不足的行跳过，无法解析的格子记为 nan"""
+    ncols = 2 + len(_CIDS)
+    times, rows = [], []
+    for parts in map(str.split, f):  # split() 自带去空白，空行得到 []，无需再 strip
+        if len(parts) < ncols:
             continue
-        for idx, cid in enumerate(sorted(COMMERCE_MAP.keys()), start=2):
-            try:
-                price = float(parts[idx])
-                hist[cid].append(price)
-            except Exception:
-                pass
-    return hist
+        times.append(f"{parts[0]} {parts[1]}")
+        rows.append([_to_float(tok) for tok in parts[2:ncols]])
+    return times, np.array(rows, dtype=np.float64).reshape(-1, len(_CIDS))
 
-def save_data_row(current_date, time_slot, commerce_data):
-    """将当前价格追加到历史文件"""
+def _read_history_arr():
+    """
+    一次性解析 price_history.txt，返回 (times, mat, header_ok)：
+      - times: ["YYYY/MM/DD HH:MM", ...]
+      - mat:   shape (N, len(COMMERCE_MAP)) 的 float 矩阵，列顺序同 _CIDS，无法解析的格子为 nan
+      - header_ok: 表头是否匹配；不匹配时行照常返回（图表照画），但不应当作分析用的历史
+    先用 np.loadtxt（C 解析器）；遇到残缺/非数字行抛 ValueError 时，退回 _parse_history_lines 逐行容错。
+    """
+    empty = ([], np.empty((0, len(_CIDS))), True)
     if not os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            header = "日期 时间 " + " ".join(COMMERCE_MAP[cid] for cid in sorted(COMMERCE_MAP.keys()))
-            f.write(header + "\n")
-
-    last_line = None
+        return empty
+    dtype = [("d", "U16"), ("t", "U8")] + [(f"p{cid}", "f8") for cid in _CIDS]
     with open(DATA_FILE, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-        if len(lines) > 1:
-            last_line = lines[-1].strip()
-
-    if last_line:
-        parts = last_line.split()
-        if len(parts) >= 2:
-            last_date, last_time = parts[0], parts[1]
-            if last_date == current_date and last_time == time_slot:
-                print(f"⚠️ {current_date} {time_slot} 已存在，跳过保存")
-                return
+        header = f.readline()
+        while header and not header.strip():  # 跳过开头空行，首个非空行即表头
+            header = f.readline()
+        header = header.split()
+        if not header:
+            return empty
+        header_ok = header == _EXPECTED_HEADER
+        if not header_ok:
+            print("⚠️ 表头不匹配，忽略历史。")
+        body_start = f.tell()
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")  # 只有表头时 numpy 会警告空输入
+                # comments=None：历史里没有注释语法，"#" 开头的格子按坏值处理而不是吞掉整行
+                rec = np.loadtxt(f, dtype=dtype, usecols=range(2 + len(_CIDS)), comments=None, ndmin=1)
+        except ValueError:
+            f.seek(body_start)
+            times, mat = _parse_history_lines(f)
+            return times, mat, header_ok
+    if rec.size == 0:
+        return [], np.empty((0, len(_CIDS))), header_ok
+    times = np.char.add(np.char.add(rec["d"], " "), rec["t"]).tolist()
+    mat = np.column_stack([rec[f"p{cid}"] for cid in _CIDS])
+    return times, mat, header_ok
+
+def _price_row(commerce_data):
+    """当期价格 -> 与历史矩阵同列序的一行（缺失/非法为 nan）"""
+    return np.array([commerce_data.get(cid, 0) for cid in _CIDS], dtype=float)
+
+def history_from_arr(mat):
+    """历史矩阵 -> {cid: [prices...]}（丢弃 nan）"""
+    hist = {}
+    for i, cid in enumerate(_CIDS):
+        col = mat[:, i]
+        hist[cid] = col[~np.isnan(col)].tolist()
+    return hist
 
-    row = [current_date, time_slot] + [str(commerce_data.get(cid, 0)) for cid in sorted(COMMERCE_MAP.keys())]
-    with open(DATA_FILE, "a", encoding="utf-8") as f:
-        f.write(" ".join(row) + "\n")
-    print("✅ 已追加到 price_history.txt")
+def _read_last_line(f, size, tail_bytes=512):
+    """在已打开的二进制文件 f 中只读取末尾 tail_bytes 字节，返回最后一个非空行（空文件返回 None）"""
+    if size == 0:
+        return None
+    f.seek(-min(tail_bytes, size), os.SEEK_END)
+    lines = [ln for ln in f.read().splitlines() if ln.strip()]
+    return lines[-1].decode("utf-8", errors="ignore").strip() if lines else None
+
+def _dedup_slots(rows, prev):
+    """rows 中与上一行（prev 或本批前一条）不同档位、需要写入的下标"""
+    keep = []
+    for i, (current_date, time_slot, _) in enumerate(rows):
+        if (current_date, time_slot) != prev:
+            keep.append(i)
+            prev = (current_date, time_slot)
+    return keep
+
+def append_data_rows(rows):
+    """
+    批量追加 [(date, slot, commerce_data), ...] 到历史文件：只打开一次、一次 writelines。
+    与上一行（文件尾行或本批前一条）同档位的记录跳过。
+    返回实际追加的 [(rows 中的下标, "date slot", 价格行), ...]
+    """
+    appended, lines = [], []
+    # 一次 a+ 打开（不存在则创建）：空文件先写表头，否则读尾行去重；追加模式下写入总在文件末尾
+    with open(DATA_FILE, "a+b") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            lines.append((" ".join(_EXPECTED_HEADER) + "\n").encode("utf-8"))
+        last_line = _read_last_line(f, size)
+        keep = set(_dedup_slots(rows, tuple(last_line.split()[:2]) if last_line else ()))
+        for i, (current_date, time_slot, commerce_data) in enumerate(rows):
+            if i not in keep:
+                print(f"⚠️ {current_date} {time_slot} 已存在，跳过保存")
+                continue
+            row = [current_date, time_slot] + [str(commerce_data.get(cid, 0)) for cid in _CIDS]
+            lines.append((" ".join(row) + "\n").encode("utf-8"))
+            appended.append((i, f"{current_date} {time_slot}", _price_row(commerce_data)))
+        f.writelines(lines)
+    if appended:
+        print(f"✅ 已追加 {len(appended)} 行到 price_history.txt")
+    return appended
 
 # =================== 分析逻辑 ===================
-def calculate_trend_analysis(prices):
+# 分析函数是纯函数：按 (价格序列元组) 记忆化，重复生成报告时直接命中缓存。
+# 趋势缓存只服务 calculate_trend_analysis 的调用方（单独调用、calculate_trend_analyses
+# 的不等长回退）；build_report 的等长批量路径直接走 numpy，不经过这里。
+# 缓存里的 dict 是共享对象，对外返回浅拷贝，避免调用方修改污染缓存。
+@lru_cache(maxsize=256)
+def _trend_analysis_cached(prices):
     if len(prices) < 3:
         return {
             'short_trend': '数据不足', 'mid_trend': '数据不足',
@@ -141,7 +221,12 @@ def calculate_trend_analysis(prices):
     recent_mid = prices[-mid_window:]
     mid_trend_slope = (recent_mid[-1] - recent_mid[0]) / (len(recent_mid) - 1) if len(recent_mid) >= 2 else 0
 
-    price_range = max(prices) - min(prices)
+    result = _describe_trend(short_trend_slope, mid_trend_slope, max(prices) - min(prices))
+    result['prices'] = prices
+    return result
+
+def _describe_trend(short_trend_slope, mid_trend_slope, price_range):
+    """短/中期斜率 + 价格区间 -> 趋势方向、强度与描述"""
     if price_range > 0:
         short_strength = abs(short_trend_slope) / price_range * 100
         mid_strength = abs(mid_trend_slope) / price_range * 100
@@ -172,17 +257,45 @@ def calculate_trend_analysis(prices):
         'short_trend': short_direction, 'mid_trend': mid_direction,
         'trend_strength': (short_strength + mid_strength) / 2,
         'trend_description': trend_desc, 'short_slope': short_trend_slope,
-        'mid_slope': mid_trend_slope, 'prices': prices
+        'mid_slope': mid_trend_slope
     }
 
-def calculate_price_analysis(current_price, historical_prices):
+def calculate_trend_analysis(prices):
+    result = dict(_trend_analysis_cached(tuple(prices)))
+    result['prices'] = prices
+    return result
+
+def calculate_trend_analyses(series_by_cid):
+    """
+    {cid: prices} -> {cid: 趋势分析}，结果同逐个调用 calculate_trend_analysis。
+    各序列等长时堆成 (T, K) 矩阵，一次算出所有商户的斜率与区间；否则逐个计算。
+    """
+    lengths = {len(prices) for prices in series_by_cid.values()}
+    if len(lengths) != 1 or lengths.pop() < 3:
+        return {cid: calculate_trend_analysis(prices) for cid, prices in series_by_cid.items()}
+
+    cids = list(series_by_cid)
+    m = np.array([series_by_cid[cid] for cid in cids], dtype=np.float64).T
+    mid_window = min(7, m.shape[0])
+    short_slopes = ((m[-1] - m[-3]) / 2).tolist()
+    mid_slopes = ((m[-1] - m[-mid_window]) / (mid_window - 1)).tolist()
+    ranges = (m.max(axis=0) - m.min(axis=0)).tolist()
+
+    result = {}
+    for i, cid in enumerate(cids):
+        result[cid] = _describe_trend(short_slopes[i], mid_slopes[i], ranges[i])
+        result[cid]['prices'] = series_by_cid[cid]
+    return result
+
+@lru_cache(maxsize=256)
+def _price_analysis_cached(current_price, historical_prices):
     if not historical_prices:
         return {'avg': current_price,'min': current_price,'max': current_price,
                 'from_min_points': 0,'from_min_percent': 0,'from_max_points': 0,'from_max_percent': 0,
                 'percentile': 50,'sample_size': 0}
-    all_prices = historical_prices + [current_price]
-    avg_price = statistics.mean(all_prices)
-    min_price = min(all_prices); max_price = max(all_prices)
+    arr = np.asarray(historical_prices + (current_price,), dtype=np.float64)
+    avg_price = float(arr.mean())
+    min_price = float(arr.min()); max_price = float(arr.max())
     from_min_points = current_price - min_price
     from_max_points = current_price - max_price
     price_range = max_price - min_price
@@ -191,8 +304,8 @@ def calculate_price_analysis(current_price, historical_prices):
         from_max_percent = (from_max_points / price_range) * 100
     else:
         from_min_percent = from_max_percent = 0
-    lower_count = sum(1 for p in all_prices if p < current_price)
-    percentile = (lower_count / len(all_prices)) * 100
+    lower_count = int((arr < current_price).sum())
+    percentile = (lower_count / arr.size) * 100
     return {
         'avg': avg_price,'min': min_price,'max': max_price,
         'from_min_points': from_min_points,'from_min_percent': from_min_percent,
@@ -200,12 +313,60 @@ def calculate_price_analysis(current_price, historical_prices):
         'percentile': percentile,'sample_size': len(historical_prices)
     }
 
+def calculate_price_analysis(current_price, historical_prices):
+    return dict(_price_analysis_cached(current_price, tuple(historical_prices)))
+
+# —— 投资建议查表 —— #
+# 百分位档：0 极低(<=15) / 1 低(<=35) / 2 中(<=65) / 3 高(<85) / 4 极高(>=85)
+_ADVICE_BAND_THRESHOLDS = (15, 35, 65)
+_POSITION_LEVEL_THRESHOLDS = (15, 35, 65, 85)
+_POSITION_LEVELS = ("极低位", "低位", "中位", "高位", "极高位")
+_DIRECTIONS = {"强势上升": 2, "温和上升": 1, "横盘": 0, "温和下降": -1}  # 其余（强势下降/数据不足）为 -2
+
+# 趋势调整 _TREND_ADJ[band, direction+2]，理由 _TREND_REASONS[band][direction+2]，导入时一次建好
+_TREND_ADJ = np.array([
+    # 方向: -2             -1             0     1              2
+    [5.0 + 2 * 2.0, 5.0 + 1 * 2.0, 4.0, 4.5 + 1 * 1.5, 4.5 + 2 * 1.5],
+    [4.0 + 2 * 1.5, 4.0 + 1 * 1.5, 3.0, 3.5 + 1 * 1.2, 3.5 + 2 * 1.2],
+    [-2.0, -1.0, 0.0, 1.0, 2.0],
+    [-1.0 - 2 * 0.5, -1.0 - 1 * 0.5, 1.8, 2.8, 2.5],
+    [-2.0 - 2 * 0.8, -2.0 - 1 * 0.8, -2.0, -4.0 - 1 * 1.0, -4.0 - 2 * 1.0],
+])
+
+_TREND_REASONS = (
+    ("极低位深跌，强烈买入信号",) * 2 + ("极低位盘整，强烈买入",) + ("极低位反弹，强烈买入",) * 2,
+    ("低位深跌，抄底良机",) * 2 + ("低位盘整，可逐步建仓",) + ("低位反弹，趋势向好",) * 2,
+    ("中位下跌，暂时观望",) * 2 + ("中位盘整，等待方向",) + ("中位上涨，可适量参与",) * 2,
+    ("高位回落，建议减仓",) * 2 + ("高位盘整，注意风险",) + ("高位上涨，谨慎持有",) * 2,
+    ("极高位回落，及时止盈",) * 2 + ("极高位盘整，警惕回调",) + ("极高位追涨，风险极大",) * 2,
+)
+# 例外：高位回落但描述里出现"反转"
+_HIGH_REVERSAL_ADJ, _HIGH_REVERSAL_REASON = 1.5, "高位回落但出现反转信号，观望为主"
+
+# 止跌反弹（中期下降、短期上升）：按 百分位 <=35 / <=65 / 其余 加分
+_REV_UP_THRESHOLDS = (35, 65)
+_REV_UP_ADJ = (2.0, 1.5, 1.0)
+_REV_UP_REASONS = ("低位止跌反弹，强烈买入", "中位止跌反弹，可适量买入", "高位止跌反弹，谨慎持有，可适当加仓")
+# 冲高回落（中期上升、短期下降）：按 百分位 <65 / <85 / 其余 减分
+_REV_DOWN_THRESHOLDS = (65, 85)
+_REV_DOWN_ADJ = (0.5, 1.5, 2.0)
+_REV_DOWN_REASONS = ("中低位冲高回落，暂时观望", "高位冲高回落，建议减仓", "极高位冲高回落，强烈卖出")
+
+# 最终评分 -> 建议：bisect_right 落点即满足 score >= 阈值 的个数
+_SCORE_THRESHOLDS = (1.0, 2.0, 3.0, 4.5, 5.5, 7.0, 8.5)
+_ADVICE = (
+    ("💸💸💸强烈卖出", "💸💸💸", "清仓离场"),
+    ("💸💸卖出", "💸💸", "重仓减仓"),
+    ("💸建议卖出", "💸", "建议减仓"),
+    ("⚠️谨慎持有", "⚠️", "谨慎持有，可适当加仓"),
+    ("👀观望等待", "👀", "暂时观望"),
+    ("💰建议买入", "💰", "适量买入"),
+    ("💰💰买入", "💰💰", "重仓买入"),
+    ("💰💰💰强烈买入", "💰💰💰", "满仓买入"),
+)
+
 def calculate_investment_advice(percentile, trend_analysis):
-    if percentile <= 15: position_level = "极低位"
-    elif percentile <= 35: position_level = "低位"
-    elif percentile <= 65: position_level = "中位"
-    elif percentile <= 85: position_level = "高位"
-    else: position_level = "极高位"
+    position_level = _POSITION_LEVELS[bisect_left(_POSITION_LEVEL_THRESHOLDS, percentile)]
 
     position_score = 10 - (percentile / 10)
 
@@ -213,55 +374,30 @@ def calculate_investment_advice(percentile, trend_analysis):
     short_trend = trend_analysis['short_trend']
     desc = trend_analysis['trend_description']
 
-    if "强势上升" in mid_trend: direction = 2
-    elif "温和上升" in mid_trend: direction = 1
-    elif "横盘" in mid_trend: direction = 0
-    elif "温和下降" in mid_trend: direction = -1
-    else: direction = -2
+    direction = _DIRECTIONS.get(mid_trend, -2)
 
     is_reversing_up = "反转" in desc and "上升" in short_trend and direction < 0
     is_reversing_down = "反转" in desc and "下降" in short_trend and direction > 0
 
-    if percentile <= 15:
-        if direction <= -1: trend_adj, reason = 5.0 + abs(direction)*2.0, "极低位深跌，强烈买入信号"
-        elif direction >= 1: trend_adj, reason = 4.5 + direction*1.5, "极低位反弹，强烈买入"
-        else: trend_adj, reason = 4.0, "极低位盘整，强烈买入"
-    elif percentile <= 35:
-        if direction <= -1: trend_adj, reason = 4.0 + abs(direction)*1.5, "低位深跌，抄底良机"
-        elif direction >= 1: trend_adj, reason = 3.5 + direction*1.2, "低位反弹，趋势向好"
-        else: trend_adj, reason = 3.0, "低位盘整，可逐步建仓"
-    elif 65 < percentile < 85:
-        if direction >= 1: trend_adj, reason = (2.5 if direction==2 else 2.8), "高位上涨，谨慎持有"
-        elif direction <= -1:
-            if "反转" in desc: trend_adj, reason = 1.5, "高位回落但出现反转信号，观望为主"
-            else: trend_adj, reason = -1.0 - abs(direction)*0.5, "高位回落，建议减仓"
-        else: trend_adj, reason = 1.8, "高位盘整，注意风险"
-    elif percentile >= 85:
-        if direction >= 1: trend_adj, reason = -4.0 - direction*1.0, "极高位追涨，风险极大"
-        elif direction <= -1: trend_adj, reason = -2.0 - abs(direction)*0.8, "极高位回落，及时止盈"
-        else: trend_adj, reason = -2.0, "极高位盘整，警惕回调"
+    band = bisect_left(_ADVICE_BAND_THRESHOLDS, percentile) + (percentile >= 85)
+    if band == 3 and direction < 0 and "反转" in desc:
+        trend_adj, reason = _HIGH_REVERSAL_ADJ, _HIGH_REVERSAL_REASON
     else:
-        trend_adj = direction * 1.0
-        reason = "中位上涨，可适量参与" if direction >= 1 else ("中位下跌，暂时观望" if direction <= -1 else "中位盘整，等待方向")
+        trend_adj, reason = float(_TREND_ADJ[band, direction + 2]), _TREND_REASONS[band][direction + 2]
 
     if is_reversing_up:
-        trend_adj += 2.0 if percentile <= 35 else (1.5 if percentile <= 65 else 1.0)
-        reason = "低位止跌反弹，强烈买入" if percentile <= 35 else ("中位止跌反弹，可适量买入" if percentile <= 65 else "高位止跌反弹，谨慎持有，可适当加仓")
+        i = bisect_left(_REV_UP_THRESHOLDS, percentile)
+        trend_adj += _REV_UP_ADJ[i]
+        reason = _REV_UP_REASONS[i]
     elif is_reversing_down:
-        trend_adj -= 2.0 if percentile >= 85 else (1.5 if percentile >= 65 else 0.5)
-        reason = "极高位冲高回落，强烈卖出" if percentile >= 85 else ("高位冲高回落，建议减仓" if percentile >= 65 else "中低位冲高回落，暂时观望")
+        i = bisect_right(_REV_DOWN_THRESHOLDS, percentile)
+        trend_adj -= _REV_DOWN_ADJ[i]
+        reason = _REV_DOWN_REASONS[i]
 
     final_score_internal = max(0, min(15, position_score + trend_adj))
     score_display = min(10, final_score_internal * 10 / 15)
 
-    if score_display >= 8.5: advice, emoji, action = "💰💰💰强烈买入", "💰💰💰", "满仓买入"
-    elif score_display >= 7.0: advice, emoji, action = "💰💰买入", "💰💰", "重仓买入"
-    elif score_display >= 5.5: advice, emoji, action = "💰建议买入", "💰", "适量买入"
-    elif score_display >= 4.5: advice, emoji, action = "👀观望等待", "👀", "暂时观望"
-    elif score_display >= 3.0: advice, emoji, action = "⚠️谨慎持有", "⚠️", "谨慎持有，可适当加仓"
-    elif score_display >= 2.0: advice, emoji, action = "💸建议卖出", "💸", "建议减仓"
-    elif score_display >= 1.0: advice, emoji, action = "💸💸卖出", "💸💸", "重仓减仓"
-    else: advice, emoji, action = "💸💸💸强烈卖出", "💸💸💸", "清仓离场"
+    advice, emoji, action = _ADVICE[bisect_right(_SCORE_THRESHOLDS, score_display)]
 
     stars = "⭐" * max(1, min(5, round(score_display / 2)))
     prices = trend_analysis.get('prices', [])
@@ -279,61 +415,54 @@ def format_change_value(change):
     if change < 0: return f"{change:.2f}📉"
     return "0.00"
 
+_LEVEL_THRESHOLDS = (20, 40, 60, 80)  # 百分位 >= 阈值 即进入下一档
+_LEVELS = ("⚫低位", "🔵中低", "🟢中位", "🟡中高", "🔴高位")
+
 def format_analysis_text(commerce_name, current_price, change_value, analysis, trend_analysis, investment_advice):
-    if analysis['percentile'] >= 80: level = "🔴高位"
-    elif analysis['percentile'] >= 60: level = "🟡中高"
-    elif analysis['percentile'] >= 40: level = "🟢中位"
-    elif analysis['percentile'] >= 20: level = "🔵中低"
-    else: level = "⚫低位"
+    level = _LEVELS[bisect_right(_LEVEL_THRESHOLDS, analysis['percentile'])]
 
     change_str = format_change_value(change_value)
-    s = []
-    s.append(f"{commerce_name} {level}")
-    s.append(f"📊当前价格：{current_price:.2f} (变动：{change_str})")
-    s.append(f"📅历史均价：{analysis['avg']:.2f}")
-    s.append(f"🎬价格区间：{analysis['min']:.2f} ~ {analysis['max']:.2f}")
-    s.append(f"⬆️距最高：{analysis['from_max_points']:.2f}点 ({analysis['from_max_percent']:.1f}%)")
-    s.append(f"⬇️距最低：{analysis['from_min_points']:+.2f}点 ({analysis['from_min_percent']:.1f}%)")
-    s.append(f"🧮百分位：{analysis['percentile']:.1f}% (样本：{analysis['sample_size']})")
-    s.append(f"📈趋势分析：{trend_analysis['trend_description']}")
-    s.append(f"💵投资建议：{investment_advice['advice']}")
-    s.append(f"💡操作建议：{investment_advice['action_desc']}")
-    s.append(f"📝理由：{investment_advice['reason']}")
-    s.append(f"🪙优先级：{investment_advice['stars']}")
-    s.append(f"🧾评分：{investment_advice['priority_score']:.1f}/10")
-    return "\n".join(s)
+    return "\n".join((
+        f"{commerce_name} {level}",
+        f"📊当前价格：{current_price:.2f} (变动：{change_str})",
+        f"📅历史均价：{analysis['avg']:.2f}",
+        f"🎬价格区间：{analysis['min']:.2f} ~ {analysis['max']:.2f}",
+        f"⬆️距最高：{analysis['from_max_points']:.2f}点 ({analysis['from_max_percent']:.1f}%)",
+        f"⬇️距最低：{analysis['from_min_points']:+.2f}点 ({analysis['from_min_percent']:.1f}%)",
+        f"🧮百分位：{analysis['percentile']:.1f}% (样本：{analysis['sample_size']})",
+        f"📈趋势分析：{trend_analysis['trend_description']}",
+        f"💵投资建议：{investment_advice['advice']}",
+        f"💡操作建议：{investment_advice['action_desc']}",
+        f"📝理由：{investment_advice['reason']}",
+        f"🪙优先级：{investment_advice['stars']}",
+        f"🧾评分：{investment_advice['priority_score']:.1f}/10",
+    ))
 
 # =================== 图表数据与页面生成 ===================
-def build_series_from_history():
-    """读取 price_history.txt -> 图表数据 payload"""
-    if not os.path.exists(DATA_FILE):
+def build_series_from_arr(times, mat):
+    """(times, 历史矩阵) -> 图表数据 payload"""
+    if not times:
         return {"updated_at": now_cst().strftime("%Y-%m-%d %H:%M:%S"), "x": [], "series": []}
 
-    times = []
-    values_by_cid = {cid: [] for cid in sorted(COMMERCE_MAP.keys())}
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        lines = [ln.strip() for ln in f.readlines() if ln.strip()]
-    if len(lines) <= 1:
-        return {"updated_at": now_cst().strftime("%Y-%m-%d %H:%M:%S"), "x": [], "series": []}
-
-    for line in lines[1:]:
-        parts = line.split()
-        if len(parts) < 2 + len(COMMERCE_MAP):
-            continue
-        date_str, time_str = parts[0], parts[1]
-        times.append(f"{date_str} {time_str}")
-        for idx, cid in enumerate(sorted(COMMERCE_MAP.keys()), start=2):
-            try:
-                v = float(parts[idx])
-            except Exception:
-                v = None
-            values_by_cid[cid].append(v)
-
-    series = [{"id": cid, "name": COMMERCE_MAP[cid], "values": values_by_cid[cid]}
-              for cid in sorted(COMMERCE_MAP.keys())]
+    series = [{"id": cid, "name": COMMERCE_MAP[cid],
+               "values": [None if np.isnan(v) else v for v in mat[:, i].tolist()]}
+              for i, cid in enumerate(_CIDS)]
 
     return {"updated_at": now_cst().strftime("%Y-%m-%d %H:%M:%S"), "x": times, "series": series}
 
+_PLACEHOLDER = re.compile(r"\{\{(updated_at|report)\}\}")
+
+def _dump_json(obj):
+    """紧凑 JSON（UTF-8 bytes）；装了 orjson 就用它"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+@lru_cache(maxsize=1)
+def _template():
+    """页面模板只读一次"""
+    return TEMPLATE_FILE.read_text(encoding="utf-8")
+
 def write_site_assets(chart_payload: dict, report_text: str):
     """
     生成站点：
@@ -343,60 +472,34 @@ def write_site_assets(chart_payload: dict, report_text: str):
     """
     SITE_DIR.mkdir(parents=True, exist_ok=True)
 
-    (SITE_DIR / "data.json").write_text(
-        json.dumps(chart_payload, ensure_ascii=False),
-        encoding="utf-8"
-    )
+    (SITE_DIR / "data.json").write_bytes(_dump_json(chart_payload))
 
     if PUBLISH_HISTORY and os.path.exists(DATA_FILE):
-        shutil.copyfile(DATA_FILE, SITE_DIR / "price_history.txt")
-
-    html = TEMPLATE_FILE.read_text(encoding="utf-8")
-    html = html.replace("{{updated_at}}", chart_payload.get("updated_at", ""))
-    html = html.replace("{{report}}", report_text or "")
-    (SITE_DIR / "index.html").write_text(html, encoding="utf-8")
+        # 同一文件系统下硬链接即可（只改元数据），跨盘等失败时再退回整份复制
+        dest = SITE_DIR / "price_history.txt"
+        dest.unlink(missing_ok=True)
+        try:
+            os.link(DATA_FILE, dest)
+        except OSError:
+            shutil.copyfile(DATA_FILE, dest)
+
+    mapping = {"updated_at": chart_payload.get("updated_at", ""), "report": report_text or ""}
+    html = _PLACEHOLDER.sub(lambda m: mapping[m.group(1)], _template())
+    (SITE_DIR / "index.html").write_bytes(html.encode("utf-8"))
 
     print("✅ 已生成：site/index.html, site/data.json" + ("，site/price_history.txt" if PUBLISH_HISTORY else ""))
 
 # =================== 主流程 ===================
-def run():
-    if not HEADERS.get("token"):
-        raise RuntimeError("缺少 ARING_TOKEN 环境变量，请在 GitHub Secrets 配置。")
-
-    print("🚀 准备历史数据（仅本地） …")
-    ensure_local_history_only()
-
-    print("🚀 拉取最新价格 …")
-    r = requests.get(API_URL, headers=HEADERS, timeout=12)
-    if r.status_code != 200:
-        raise RuntimeError(f"请求失败：HTTP {r.status_code}")
-    payload = r.json()
-    if "data" not in payload or not isinstance(payload["data"], list):
-        raise RuntimeError("返回数据格式异常")
-
-    # 当前档位（北京时间）
-    now = now_cst()
-    current_date, time_slot = get_slot(now)
-
-    # 整理当期价格
-    commerce_data = {}
-    commerce_changes = {}
-    for item in payload["data"]:
-        cid = item.get("commerceId")
-        if cid in COMMERCE_MAP:
-            commerce_data[cid] = item.get("price", 0)
-            commerce_changes[cid] = item.get("changeValue", 0)
-
-    if not commerce_data:
-        raise RuntimeError("未获取到有效的价格数据")
-
-    # 载入历史，构建报告
-    historical = load_historical_data()
+def build_report(current_date, time_slot, commerce_data, commerce_changes, historical):
+    """当期价格 + 历史 -> 报告文本（含投资优先级排行榜）"""
     title = f"📊 {current_date} {time_slot} 价格监控报告\n{'='*40}\n"
     report_lines = [title]
 
+    trends = calculate_trend_analyses({cid: historical.get(cid, []) + [commerce_data[cid]]
+                                       for cid in _CIDS if cid in commerce_data})
+
     commerce_analysis = {}
-    for cid in sorted(COMMERCE_MAP.keys()):
+    for cid in _CIDS:
         if cid not in commerce_data:
             continue
         name = COMMERCE_MAP[cid]
@@ -405,7 +508,7 @@ def run():
         hist = historical.get(cid, [])
 
         pa = calculate_price_analysis(cur, hist)
-        trend = calculate_trend_analysis(hist + [cur])
+        trend = trends[cid]
         adv = calculate_investment_advice(pa['percentile'], trend)
 
         block = format_analysis_text(name, cur, chg, pa, trend, adv)
@@ -420,17 +523,81 @@ def run():
                                            reverse=True), 1):
         report_lines.append(f"{i}. {data['name']} ({data['priority_score']:.1f}分)")
 
-    final_report = "\n".join(report_lines).strip()
+    return "\n".join(report_lines).strip()
+
+def run_many(snapshots, now=None):
+    """
+    批量写入多个档位快照，并且只分析、生成一次站点（用于回填）。
+    snapshots: [{"date": "YYYY/MM/DD", "slot": "HH:MM", "prices": {cid: price}, "changes": {cid: change}}, ...]
+    报告针对最后一个快照，历史为它之前的全部记录。
+    """
+    if not snapshots:
+        raise RuntimeError("没有可写入的价格快照")
+    if now is None:
+        now = now_cst()
+
+    # 载入历史（只解析一次）
+    times, mat, header_ok = _read_history_arr()
+    rows = [(s["date"], s["slot"], s["prices"]) for s in snapshots]
+
+    # 先只在内存中并入最后一个快照之前、将被写入的行，生成报告；报告失败时不落盘
+    last_idx = len(rows) - 1
+    prev = tuple(times[-1].split()[:2]) if times else ()
+    earlier = [i for i in _dedup_slots(rows, prev) if i < last_idx]
+    hist_mat = mat
+    if earlier:
+        hist_mat = np.vstack([mat] + [_price_row(rows[i][2]) for i in earlier])
+
+    last = snapshots[-1]
+    final_report = build_report(last["date"], last["slot"], last["prices"], last.get("changes", {}),
+                                history_from_arr(hist_mat if header_ok else hist_mat[:0]))
 
-    # 追加历史
-    save_data_row(current_date, time_slot, commerce_data)
+    # 报告成功后再追加历史（磁盘：一次打开写完整批），图表用实际写入的行
+    appended = append_data_rows(rows)
+    if appended:
+        times = times + [t for _, t, _ in appended]
+        mat = np.vstack([mat] + [r for _, _, r in appended])
 
     # 生成图表数据 + 页面
-    chart_payload = build_series_from_history()
+    chart_payload = build_series_from_arr(times, mat)
     chart_payload["updated_at"] = now.strftime("%Y-%m-%d %H:%M:%S")  # 用北京时间
     write_site_assets(chart_payload, report_text=final_report)
 
     print("🎉 完成")
 
+def run():
+    if not HEADERS.get("token"):
+        raise RuntimeError("缺少 ARING_TOKEN 环境变量，请在 GitHub Secrets 配置。")
+
+    print("🚀 准备历史数据（仅本地） …")
+    ensure_local_history_only()
+
+    print("🚀 拉取最新价格 …")
+    r = SESSION.get(API_URL, timeout=12)
+    if r.status_code != 200:
+        raise RuntimeError(f"请求失败：HTTP {r.status_code}")
+    payload = r.json()
+    if "data" not in payload or not isinstance(payload["data"], list):
+        raise RuntimeError("返回数据格式异常")
+
+    # 当前档位（北京时间）
+    now = now_cst()
+    current_date, time_slot = get_slot(now)
+
+    # 整理当期价格
+    commerce_data = {}
+    commerce_changes = {}
+    for item in payload["data"]:
+        cid = item.get("commerceId")
+        if cid in COMMERCE_MAP:
+            commerce_data[cid] = item.get("price", 0)
+            commerce_changes[cid] = item.get("changeValue", 0)
+
+    if not commerce_data:
+        raise RuntimeError("未获取到有效的价格数据")
+
+    run_many([{"date": current_date, "slot": time_slot,
+               "prices": commerce_data, "changes": commerce_changes}], now=now)
+
 if __name__ == "__main__":
     run()